@@ -1,13 +1,16 @@
 import dash
 from dash import dcc, html, Input, Output, State, ctx
+from dash.exceptions import PreventUpdate
 from dash import dash_table
 import dash_bootstrap_components as dbc
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import pathlib
 from PIL import Image
 import base64
 import io
+import re
 
 
 class LabelManager:
@@ -29,6 +32,165 @@ class LabelManager:
         ]
 
 
+class SpatialIndex:
+    """Uniform grid over the spot coordinates for fast radius queries.
+
+    Points are sorted by grid cell so that each row of cells covered by a
+    query maps to one contiguous slice of the sorted order.
+    """
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.x_min, self.y_min = self.x.min(), self.y.min()
+        width = self.x.max() - self.x_min
+        height = self.y.max() - self.y_min
+        # aim for a handful of points per cell, but never more cells along
+        # an axis than points, so nearly collinear data cannot blow up
+        self.cell_size = max(
+            np.sqrt(width * height / len(self.x)) * 2,
+            max(width, height) / len(self.x),
+        )
+        if self.cell_size == 0:
+            self.cell_size = 1.0
+        self.n_cols = int(width // self.cell_size) + 1
+        self.n_rows = int(height // self.cell_size) + 1
+
+        cell_ids = self._cell_col(self.x) + self._cell_row(self.y) * self.n_cols
+        self.order = np.argsort(cell_ids, kind="stable")
+        counts = np.bincount(cell_ids, minlength=self.n_cols * self.n_rows)
+        self.cell_start = np.concatenate(([0], np.cumsum(counts)))
+
+    def _cell_col(self, x):
+        col = ((np.asarray(x) - self.x_min) // self.cell_size).astype(int)
+        return np.clip(col, 0, self.n_cols - 1)
+
+    def _cell_row(self, y):
+        row = ((np.asarray(y) - self.y_min) // self.cell_size).astype(int)
+        return np.clip(row, 0, self.n_rows - 1)
+
+    def _query_box(self, x_lo, x_hi, y_lo, y_hi):
+        """Return the row indices of all points in cells overlapping a box."""
+        col_lo, col_hi = self._cell_col([x_lo, x_hi])
+        row_lo, row_hi = self._cell_row([y_lo, y_hi])
+        return np.concatenate(
+            [
+                self.order[
+                    self.cell_start[row * self.n_cols + col_lo] : self.cell_start[
+                        row * self.n_cols + col_hi + 1
+                    ]
+                ]
+                for row in range(row_lo, row_hi + 1)
+            ]
+        )
+
+    def query_radius(self, cx, cy, r):
+        """Return the row indices of all points within distance r of (cx, cy)."""
+        candidates = self._query_box(cx - r, cx + r, cy - r, cy + r)
+        dist_sq = (self.x[candidates] - cx) ** 2 + (self.y[candidates] - cy) ** 2
+        return candidates[dist_sq <= r * r]
+
+    def query_path(self, xs, ys, r, raster_size=128):
+        """Return the sorted row indices of all points within distance r of a polyline.
+
+        The stroke is rasterized onto a fine grid and dilated by the radius with
+        an FFT convolution. Points in cells that are certainly inside or outside
+        the brushed region are classified from the raster, and only the thin
+        band near its edge is tested exactly against every segment.
+        """
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        if len(xs) == 1:
+            xs, ys = np.repeat(xs, 2), np.repeat(ys, 2)
+        x0, y0 = xs[:-1], ys[:-1]
+        dx, dy = np.diff(xs), np.diff(ys)
+        length_sq = dx * dx + dy * dy
+
+        cell = max(np.ptp(xs), np.ptp(ys), 2 * r) / raster_size
+        if cell == 0:
+            cell = self.cell_size
+        # a point within half_diag of a cell center and a stroke within
+        # half_diag + cell / 4 of a marked cell center bound the true distance
+        half_diag = cell * np.sqrt(2) / 2
+        inner = r - 2 * half_diag
+        outer = r + 2 * half_diag + cell / 4
+
+        x_lo, y_lo = xs.min() - outer - cell, ys.min() - outer - cell
+        n_x = int((np.ptp(xs) + 2 * outer) // cell) + 3
+        n_y = int((np.ptp(ys) + 2 * outer) // cell) + 3
+
+        # sample each segment at most cell / 2 apart and mark the sampled cells
+        n_samples = np.ceil(np.sqrt(length_sq) / (cell / 2)).astype(int) + 1
+        seg = np.repeat(np.arange(len(x0)), n_samples)
+        first = np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+        t = (np.arange(len(seg)) - first) / np.maximum(n_samples[seg] - 1, 1)
+        mask = np.zeros((n_y, n_x))
+        mask[
+            ((y0[seg] + t * dy[seg] - y_lo) // cell).astype(int),
+            ((x0[seg] + t * dx[seg] - x_lo) // cell).astype(int),
+        ] = 1
+
+        # dilate the marked cells by the inner and outer radii
+        reach = int(outer // cell)
+        offsets = np.arange(-reach, reach + 1) * cell
+        offset_sq = offsets[:, None] ** 2 + offsets[None, :] ** 2
+        # pad to a power of two, which pocketfft transforms fastest
+        shape = tuple(
+            1 << int(np.ceil(np.log2(n + 2 * reach))) for n in (n_y, n_x)
+        )
+        mask_fft = np.fft.rfft2(mask, shape)
+
+        def dilate(radius):
+            if radius < 0:
+                return np.zeros(n_y * n_x, dtype=bool)
+            kernel = (offset_sq <= radius * radius).astype(float)
+            full = np.fft.irfft2(mask_fft * np.fft.rfft2(kernel, shape), shape)
+            return (full[reach : reach + n_y, reach : reach + n_x] > 0.5).ravel()
+
+        inside, near = dilate(inner), dilate(outer)
+
+        candidates = self._query_box(
+            x_lo, x_lo + n_x * cell, y_lo, y_lo + n_y * cell
+        )
+        col = ((self.x[candidates] - x_lo) // cell).astype(int)
+        row = ((self.y[candidates] - y_lo) // cell).astype(int)
+        in_window = (col >= 0) & (col < n_x) & (row >= 0) & (row < n_y)
+        candidates, col, row = candidates[in_window], col[in_window], row[in_window]
+        flat = row * n_x + col
+        hits = [candidates[inside[flat]]]
+
+        # test the edge band exactly, block by block against nearby segments
+        in_band = near[flat] & ~inside[flat]
+        band, col, row = candidates[in_band], col[in_band], row[in_band]
+        block = 16
+        n_blocks_x = n_x // block + 1
+        block_ids = (row // block) * n_blocks_x + col // block
+        by_block = np.argsort(block_ids, kind="stable")
+        bounds = np.flatnonzero(np.diff(block_ids[by_block])) + 1
+        seg_x_lo = np.minimum(x0, x0 + dx) - r
+        seg_x_hi = np.maximum(x0, x0 + dx) + r
+        seg_y_lo = np.minimum(y0, y0 + dy) - r
+        seg_y_hi = np.maximum(y0, y0 + dy) + r
+        safe_length_sq = np.where(length_sq > 0, length_sq, 1)
+        for points in np.split(band[by_block], bounds):
+            if len(points) == 0:
+                continue
+            px, py = self.x[points], self.y[points]
+            near_segs = np.flatnonzero(
+                (seg_x_lo <= px.max())
+                & (seg_x_hi >= px.min())
+                & (seg_y_lo <= py.max())
+                & (seg_y_hi >= py.min())
+            )
+            px = px[:, None] - x0[near_segs]
+            py = py[:, None] - y0[near_segs]
+            sdx, sdy = dx[near_segs], dy[near_segs]
+            t = np.clip((px * sdx + py * sdy) / safe_length_sq[near_segs], 0, 1)
+            dist_sq = (px - t * sdx) ** 2 + (py - t * sdy) ** 2
+            hits.append(points[(dist_sq <= r * r).any(axis=1)])
+        return np.sort(np.concatenate(hits))
+
+
 label_manager = LabelManager()
 
 # initialize app
@@ -56,6 +218,20 @@ y_min, y_max = df["y"].min(), df["y"].max()
 data_width = x_max - x_min
 data_height = y_max - y_min
 
+# one y unit is drawn this many times longer than one x unit
+Y_SCALE_RATIO = 1.6
+
+spatial_index = None
+brush_radius_max = max(data_width, data_height) / 10
+
+
+def get_spatial_index():
+    # index y in screen proportions so the brush covers a circle on screen
+    global spatial_index
+    if spatial_index is None:
+        spatial_index = SpatialIndex(df["x"], df["y"] * Y_SCALE_RATIO)
+    return spatial_index
+
 app.layout = dbc.Container(
     [
         dbc.Row(
@@ -77,13 +253,19 @@ app.layout = dbc.Container(
                                         y=df["y"],
                                         mode="markers",
                                         marker=dict(
-                                            size=5, color="lightblue", opacity=1
+                                            size=5,
+                                            color=["lightblue"] * len(df),
+                                            opacity=1,
                                         ),
+                                        text=["Unlabeled (0)"] * len(df),
+                                        hovertemplate="Label: %{text}<br>X: %{x}<br>Y: %{y}<extra></extra>",
                                         name="Unlabeled",
                                     )
                                 ],
                                 layout=dict(
-                                    yaxis=dict(scaleanchor="x", scaleratio=1.6),
+                                    yaxis=dict(
+                                        scaleanchor="x", scaleratio=Y_SCALE_RATIO
+                                    ),
                                     xaxis_title="X",
                                     yaxis_title="Y",
                                     dragmode="lasso",
@@ -171,6 +353,65 @@ app.layout = dbc.Container(
                             ],
                             className="mb-3",
                         ),
+                        dbc.Card(
+                            [
+                                dbc.CardHeader("Labeling Mode", className="p-2"),
+                                dbc.CardBody(
+                                    [
+                                        dbc.Row(
+                                            [
+                                                dbc.Col(
+                                                    [
+                                                        dcc.RadioItems(
+                                                            id="labeling-mode",
+                                                            options=[
+                                                                {
+                                                                    "label": "Click / Lasso",
+                                                                    "value": "select",
+                                                                },
+                                                                {
+                                                                    "label": "Brush",
+                                                                    "value": "brush",
+                                                                },
+                                                            ],
+                                                            value="select",
+                                                            inline=True,
+                                                            className="small",
+                                                        ),
+                                                    ],
+                                                    width=6,
+                                                ),
+                                                dbc.Col(
+                                                    [
+                                                        html.Label(
+                                                            "Brush Radius",
+                                                            className="mb-0 small",
+                                                        ),
+                                                        dcc.Slider(
+                                                            id="brush-radius-slider",
+                                                            min=brush_radius_max
+                                                            / 100,
+                                                            max=brush_radius_max,
+                                                            value=brush_radius_max
+                                                            / 5,
+                                                            marks=None,
+                                                            tooltip={
+                                                                "placement": "bottom",
+                                                                "always_visible": True,
+                                                            },
+                                                            className="mb-2",
+                                                        ),
+                                                    ],
+                                                    width=6,
+                                                ),
+                                            ]
+                                        ),
+                                    ],
+                                    className="p-2",
+                                ),
+                            ],
+                            className="mb-3",
+                        ),
                         dbc.Card(
                             [
                                 dbc.CardHeader("Point Controls", className="p-2"),
@@ -375,6 +616,7 @@ app.layout = dbc.Container(
                             className="mb-3",
                         ),
                         dcc.Store(id="selected-points-store", data=[]),
+                        dcc.Store(id="brush-store"),
                         html.Div(id="label-output"),
                     ],
                     width=7,
@@ -440,6 +682,7 @@ app.layout = dbc.Container(
     Input("point-size-slider", "value"),
     Input("point-opacity-slider", "value"),
     Input("table", "data_timestamp"),
+    Input("labeling-mode", "value"),
     State("new-label-name", "value"),
     State("new-label-color", "value"),
     State("table", "data"),
@@ -459,11 +702,15 @@ def update_data(
     point_size,
     point_opacity,
     table_timestamp,
+    labeling_mode,
     new_label_name,
     new_label_color,
     rows,
 ):
     triggered_id = ctx.triggered_id if ctx.triggered_id else "No clicks yet"
+    if triggered_id == "scatter-plot" and labeling_mode == "brush":
+        # brush clicks are applied incrementally by apply_brush
+        raise PreventUpdate
     df_updated = pd.DataFrame(rows)
     management_output = None
 
@@ -546,10 +793,11 @@ def update_data(
         )
 
     fig.update_layout(
-        yaxis=dict(scaleanchor="x", scaleratio=1.6),
+        yaxis=dict(scaleanchor="x", scaleratio=Y_SCALE_RATIO),
         xaxis_title="X",
         yaxis_title="Y",
-        dragmode="lasso",
+        dragmode="drawopenpath" if labeling_mode == "brush" else "lasso",
+        newshape=dict(line=dict(color="gray", width=1, dash="dot")),
         uirevision=True,
     )
 
@@ -571,6 +819,100 @@ def parse_image_contents(contents):
     return img
 
 
+def parse_path_vertices(path):
+    number = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+    xs, ys = [], []
+    for vertex in re.split(r"[MLZ]", path):
+        coords = re.findall(number, vertex)
+        if len(coords) == 2:
+            xs.append(float(coords[0]))
+            ys.append(float(coords[1]))
+    return xs, ys
+
+
+@app.callback(
+    Output("brush-store", "data"),
+    Input("scatter-plot", "clickData"),
+    Input("scatter-plot", "relayoutData"),
+    State("labeling-mode", "value"),
+    State("brush-radius-slider", "value"),
+    State("label-selector", "value"),
+    prevent_initial_call=True,
+)
+def apply_brush(click_data, relayout_data, labeling_mode, radius, selected_label):
+    if labeling_mode != "brush":
+        raise PreventUpdate
+
+    if "scatter-plot.clickData" in ctx.triggered_prop_ids:
+        if not click_data:
+            raise PreventUpdate
+        point = click_data["points"][0]
+        indices = get_spatial_index().query_radius(
+            point["x"], point["y"] * Y_SCALE_RATIO, radius
+        )
+        clear_shapes = False
+    else:
+        # plotly only reports a drawn path once the stroke is released
+        if not relayout_data or not relayout_data.get("shapes"):
+            raise PreventUpdate
+        xs, ys = parse_path_vertices(relayout_data["shapes"][-1].get("path", ""))
+        if not xs:
+            raise PreventUpdate
+        indices = get_spatial_index().query_path(
+            xs, [y * Y_SCALE_RATIO for y in ys], radius
+        )
+        clear_shapes = True
+
+    label_info = label_manager.labels[selected_label]
+    return {
+        "indices": indices.tolist(),
+        "label": selected_label,
+        "color": label_info["color"],
+        "text": f"{label_info['name']} ({selected_label})",
+        "clear_shapes": clear_shapes,
+    }
+
+
+# apply brushed indices in the browser, where the labels in the table are
+# current, replacing the color, text and table arrays in one update each
+app.clientside_callback(
+    """
+    function (brush, figure, rows) {
+        const noUpdate = window.dash_clientside.no_update;
+        const trace = figure.data[0];
+        const color = trace.marker.color.slice();
+        const text = trace.text.slice();
+        const newRows = rows.slice();
+        let changed = false;
+        for (const i of brush.indices) {
+            if (newRows[i].label !== brush.label) {
+                color[i] = brush.color;
+                text[i] = brush.text;
+                newRows[i] = {...newRows[i], label: brush.label};
+                changed = true;
+            }
+        }
+        if (!changed && !brush.clear_shapes) {
+            return [noUpdate, noUpdate];
+        }
+
+        const data = figure.data.slice();
+        data[0] = {...trace, marker: {...trace.marker, color: color}, text: text};
+        const layout = brush.clear_shapes
+            ? {...figure.layout, shapes: []}
+            : figure.layout;
+        return [{...figure, data: data, layout: layout}, changed ? newRows : noUpdate];
+    }
+    """,
+    Output("scatter-plot", "figure", allow_duplicate=True),
+    Output("table", "data", allow_duplicate=True),
+    Input("brush-store", "data"),
+    State("scatter-plot", "figure"),
+    State("table", "data"),
+    prevent_initial_call=True,
+)
+
+
 @app.callback(
     Output("selected-points-store", "data"),
     Input("scatter-plot", "selectedData"),